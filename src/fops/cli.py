@@ -9,7 +9,6 @@ from typing import Annotated, Final
 import typer
 
 import fops
-from fops import core
 
 logger = logging.getLogger(__name__)
 
@@ -158,6 +157,8 @@ def archive(
     $ fops create archive --fmt gztar
     $ fops create archive --pattern '*.txt' --pattern '*.md'
     """
+    from fops import core
+
     try:
         archive_path = core.create_archive(directory_path, pattern, name, fmt)
         echo_success(f"done: created {archive_path}")
@@ -184,6 +185,8 @@ def branches(
     $ fops delete branches --refs
     $ fops delete branches --protect some_branch --protect another_branch
     """
+    from fops import core
+
     cwd = Path.cwd()
     if not core.is_git_repo(cwd):
         logger.error("current directory is not a git repository: %s", cwd)
@@ -238,13 +241,16 @@ def cache(
     $ fops delete cache --dp '*.egg-info'
     $ fops delete cache --dp '*.egg-info' --fp '*.cache'
     """
+    from fops import core
+
     cache_dir_patterns = CACHE_DIR_PATTERNS.union(dp or {})
     cache_file_patterns = CACHE_FILE_PATTERNS.union(fp or {})
 
     try:
         logger.info("deleting cache in directory: %s", directory_path)
-        num_deleted = core.delete_cache_dirs(directory_path, cache_dir_patterns)
-        num_deleted += core.delete_cache_files(directory_path, cache_file_patterns)
+        num_deleted = core.delete_cache(
+            directory_path, cache_dir_patterns, cache_file_patterns
+        )
 
         item_label = "item" if num_deleted == 1 else "items"
         message = f"done: deleted {num_deleted} {item_label}"
@@ -299,6 +305,8 @@ def extensions(
     Example:
     $ fops rename extensions --copy --recursive .txt .md --dry-run
     """
+    from fops import core
+
     try:
         num_processed = core.rename_extensions(
             directory_path,
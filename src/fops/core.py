@@ -1,5 +1,6 @@
 __all__ = (
     "create_archive",
+    "delete_cache",
     "delete_cache_dirs",
     "delete_cache_files",
     "delete_local_branches",
@@ -10,26 +11,57 @@ __all__ = (
 )
 
 import contextlib
+import fnmatch
+import functools
+import itertools
 import logging
+import operator
 import os
-import shlex
+import re
 import shutil
 import subprocess
+import tarfile
 import tempfile
-from collections.abc import Sequence
+import time
+import zipfile
+from collections.abc import Collection, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from shutil import copy2, get_archive_formats, make_archive
-from typing import TypeVar
+from shutil import copy2, get_archive_formats
+from typing import Final
 
 import purekit as pk
 import timeteller as tt
 from clsforge import InvalidChoiceError
 
-T = TypeVar("T")
+PathPattern = tuple[tuple[re.Pattern[str] | None, ...], bool]
 
 
 logger = logging.getLogger(__name__)
 
+TIMESTAMP_TRANSLATION: Final[dict[int, str]] = str.maketrans({":": "-", ".": "-"})
+
+ARCHIVE_SUFFIXES: Final[dict[str, str]] = {
+    "zip": ".zip",
+    "tar": ".tar",
+    "gztar": ".tar.gz",
+    "bztar": ".tar.bz2",
+    "xztar": ".tar.xz",
+    "zstdtar": ".tar.zst",
+}
+
+TAR_MODES: Final[dict[str, str]] = {
+    "tar": "w",
+    "gztar": "w:gz",
+    "bztar": "w:bz2",
+    "xztar": "w:xz",
+    "zstdtar": "w:zst",
+}
+
+COPY_CHUNK_SIZE: Final[int] = 1 << 20
+
+PRUNE_DIRS: Final[frozenset[str]] = frozenset({".git", ".venv", "node_modules", "venv"})
+
 
 def create_archive(
     directory_path: Path,
@@ -52,60 +84,117 @@ def create_archive(
     arch_format = validate_archive_format(archive_format)
     logger.debug("archive format: %r", arch_format)
 
-    # collect matches deterministically and deduplicate
-    matched_paths: set[Path] = set()
-    for ptrn in ptrns:
-        matched_paths.update(target_dir.rglob(ptrn))
+    # match all patterns in a single walk, which visits each path only once
+    if set(ptrns) == {"**/*"}:
+        # everything below the root matches, so skip per-entry pattern matching
+        matched = list(iter_all_entries(target_dir))
+    else:
+        compiled_ptrns = [compile_path_pattern(p) for p in ptrns]
+        matched = list(iter_matching_entries(target_dir, compiled_ptrns))
 
     # sort by relative path for deterministic archive contents/order
-    paths = sorted(matched_paths, key=lambda p: str(p.relative_to(target_dir)))
+    matched.sort(key=operator.itemgetter(0))
+
+    # archive names have no directory components, so this is relative to the cwd
+    arch_path = Path(f"{arch_name}{ARCHIVE_SUFFIXES[arch_format]}")
+
+    # a previous archive in the archived directory must not be read into its successor
+    try:
+        arch_stat = os.lstat(arch_path)
+    except FileNotFoundError:
+        pass
+    else:
+        matched = [
+            (rel_src, entry)
+            for rel_src, entry in matched
+            if entry.name != arch_path.name
+            or not os.path.samestat(entry.stat(follow_symlinks=False), arch_stat)
+        ]
 
     dir_count = 0
     file_count = 0
-    logger.info("archiving %d path(s) in directory: %s", len(paths), target_dir)
-    with tempfile.TemporaryDirectory() as tmpdir:
-        temp_dir = Path(tmpdir)
-        for src in paths:
-            rel_src = src.relative_to(target_dir)
-            dst = temp_dir / rel_src
-
-            if src.is_dir():
-                dst.mkdir(parents=True, exist_ok=True)
-                dir_count += 1
-                logger.info("archived: %s", rel_src)
-                continue
+    log_archived = logger.isEnabledFor(logging.INFO)
+    logger.info("archiving %d path(s) in directory: %s", len(matched), target_dir)
+    # write next to the target and swap it in, so a failure never leaves a partial file
+    tmp_path = arch_path.with_name(f".{arch_path.name}.{os.getpid()}.tmp")
+    try:
+        with open_archive(tmp_path, arch_format) as archive:
+            for rel_src, entry in matched:
+                # entry types come from the directory listing, saving a stat per path
+                if entry.is_symlink() or entry.is_file(follow_symlinks=False):
+                    file_count += 1
+                elif entry.is_dir(follow_symlinks=False):
+                    dir_count += 1
+                else:
+                    logger.warning("skipping: %s", rel_src)
+                    continue
 
-            dst.parent.mkdir(parents=True, exist_ok=True)
+                add_to_archive(archive, entry, rel_src)
+                if log_archived:
+                    logger.info("archived: %s", rel_src)
 
-            if src.is_symlink():
-                target_link = os.readlink(src)
-                if dst.exists() or dst.is_symlink():
-                    dst.unlink()
-                os.symlink(target_link, dst)
-                file_count += 1
-                logger.info("archived: %s", rel_src)
+        os.replace(tmp_path, arch_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            tmp_path.unlink()
+        raise
 
-            elif src.is_file():
-                copy2(src, dst)
-                file_count += 1
-                logger.info("archived: %s", rel_src)
+    logger.debug("created archive")
+    logger.info("number of archived directories: %s", dir_count)
+    logger.info("number of archived files: %s", file_count)
 
-            else:
-                logger.warning("skipping: %s", rel_src)
-                continue
+    return arch_path
 
-        arch = make_archive(str(Path(arch_name)), arch_format, root_dir=str(temp_dir))
-        logger.debug("created archive")
 
-    logger.info("number of archived directories: %s", dir_count)
-    logger.info("number of archived files: %s", file_count)
+def open_archive(
+    archive_path: Path, archive_format: str
+) -> zipfile.ZipFile | tarfile.TarFile:
+    """Return a new archive opened for writing in the specified format."""
+    if archive_format == "zip":
+        return zipfile.ZipFile(
+            archive_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True
+        )
+    return tarfile.open(archive_path, TAR_MODES[archive_format])
+
+
+def add_to_archive(
+    archive: zipfile.ZipFile | tarfile.TarFile,
+    entry: os.DirEntry[str],
+    arcname: str,
+) -> None:
+    """Add a single directory, file or symlink to the archive without recursion."""
+    if isinstance(archive, tarfile.TarFile):
+        archive.add(entry.path, arcname=arcname, recursive=False)
+
+    elif entry.is_symlink():
+        # store the link itself rather than the content it points to
+        info = get_zip_info(arcname, entry.stat(follow_symlinks=False))
+        info.create_system = 3  # unix, so that the mode bits are honored
+        archive.writestr(info, os.readlink(entry.path))
 
-    return Path(arch).relative_to(Path.cwd())
+    elif entry.is_file(follow_symlinks=False):
+        # stream in large chunks; zipfile folds each one through zlib.crc32
+        with open(entry.path, "rb") as src:
+            info = get_zip_info(arcname, os.fstat(src.fileno()))
+            info.compress_type = archive.compression
+            with archive.open(info, "w") as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+    else:
+        archive.write(entry.path, arcname)
+
+
+def get_zip_info(arcname: str, stat: os.stat_result) -> zipfile.ZipInfo:
+    """Return zip member info with timestamp, mode and size taken from stat."""
+    info = zipfile.ZipInfo(arcname, time.localtime(stat.st_mtime)[:6])
+    info.external_attr = (stat.st_mode & 0xFFFF) << 16
+    info.file_size = stat.st_size
+    return info
 
 
 def get_timestamp() -> str:
     """Return a timestamp string."""
-    return tt.core.utc_timestamp_ms().translate(str.maketrans({":": "-", ".": "-"}))
+    return tt.core.utc_timestamp_ms().translate(TIMESTAMP_TRANSLATION)
 
 
 def validate_archive_name(archive_name: str) -> str:
@@ -118,57 +207,251 @@ def validate_archive_name(archive_name: str) -> str:
 def validate_archive_format(archive_format: str) -> str:
     """Return validated archive format."""
     fmt_choice = archive_format.lower()
-    fmt_choices = {fmt for fmt, _ in get_archive_formats()}
+    fmt_choices = get_archive_format_choices()
     if fmt_choice not in fmt_choices:
-        raise InvalidChoiceError(fmt_choice, fmt_choices)
+        raise InvalidChoiceError(fmt_choice, sorted(fmt_choices))
     return fmt_choice
 
 
+@functools.lru_cache(maxsize=1)
+def get_archive_format_choices() -> frozenset[str]:
+    """Return archive formats that are both available and supported for writing."""
+    return frozenset(fmt for fmt, _ in get_archive_formats() if fmt in ARCHIVE_SUFFIXES)
+
+
 def is_git_repo(path: Path) -> bool:
     """Return True if path is inside a Git repository."""
     try:
-        command = f"git -C {path.as_posix()} rev-parse --is-inside-work-tree"
+        command = ["git", "-C", path.as_posix(), "rev-parse", "--is-inside-work-tree"]
         return run(command, pk.meta.get_caller_name()) == "true"
     except subprocess.CalledProcessError:
         return False
 
 
-def delete_cache_dirs(directory_path: Path, cache_dir_patterns: set[str]) -> int:
-    """Delete cache directories in the specified directory."""
+def delete_cache(
+    directory_path: Path,
+    cache_dir_patterns: set[str],
+    cache_file_patterns: set[str],
+    prune_dirs: Collection[str] = PRUNE_DIRS,
+) -> int:
+    """Delete cache directories and files in the specified directory.
+
+    Directories named in prune_dirs are never descended into, but are still deleted
+    when they match a cache directory pattern.
+    """
+    is_cache_dir = compile_name_patterns(cache_dir_patterns).match
+    is_cache_file = compile_name_patterns(cache_file_patterns).match
+
+    cache_dirs: list[str] = []
+    cache_files: list[str] = []
+    for dir_entries, file_entries in walk_directory(directory_path):
+        subdir_entries: list[os.DirEntry[str]] = []
+        for entry in dir_entries:
+            if is_cache_dir(entry.name):
+                cache_dirs.append(entry.path)
+            elif entry.name not in prune_dirs:
+                subdir_entries.append(entry)
+
+        # never descend into pruned or cache directories
+        dir_entries[:] = subdir_entries
+
+        cache_files.extend(e.path for e in file_entries if is_cache_file(e.name))
+
+    # deletion targets are disjoint, and unlink/rmdir syscalls release the GIL
     count = 0
-    for dir_pattern in cache_dir_patterns:
-        try:
-            for path in directory_path.rglob(dir_pattern):
-                if "venv" in str(path):
-                    continue
-                shutil.rmtree(path.absolute(), ignore_errors=False)
-                logger.info("deleted: %s", path.relative_to(directory_path))
-                count += 1
-        except Exception as exc:
-            logger.warning("skipping: dir pattern: %s -> %s", dir_pattern, repr(exc))
-            continue
+    log_deleted = logger.isEnabledFor(logging.INFO)
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(remove_cache_dir, path): path for path in cache_dirs}
+        futures.update({executor.submit(os.unlink, path): path for path in cache_files})
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as exc:
+                rel_path = os.path.relpath(futures[future], directory_path)
+                logger.warning("skipping: %s -> %s", rel_path, repr(exc))
+                continue
+
+            count += 1
+            if log_deleted:
+                logger.info(
+                    "deleted: %s", os.path.relpath(futures[future], directory_path)
+                )
+
     return count
 
 
+def remove_cache_dir(path: str) -> None:
+    """Remove a cache directory, which typically contains only files."""
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+    os.rmdir(path)
+
+
+def delete_cache_dirs(directory_path: Path, cache_dir_patterns: set[str]) -> int:
+    """Delete cache directories in the specified directory."""
+    return delete_cache(directory_path, cache_dir_patterns, set())
+
+
 def delete_cache_files(directory_path: Path, cache_file_patterns: set[str]) -> int:
     """Delete cache files in the specified directory."""
-    count = 0
-    for file_pattern in cache_file_patterns:
+    return delete_cache(directory_path, set(), cache_file_patterns)
+
+
+def compile_name_patterns(patterns: Collection[str]) -> re.Pattern[str]:
+    """Return a single regex matching a name against any of the glob patterns."""
+    if not patterns:
+        return re.compile(r"(?!)")
+    return re.compile("|".join(fnmatch.translate(ptrn) for ptrn in sorted(patterns)))
+
+
+def compile_path_pattern(pattern: str) -> PathPattern:
+    """Return per-segment regexes of a recursive glob pattern and its dirs-only flag.
+
+    Like Path.rglob, the pattern may match at any depth below the root directory,
+    None stands for '**' and a trailing '/' or '**' matches directories only.
+    """
+    if not pattern:
+        raise ValueError("pattern must not be empty")
+
+    posix_pattern = pattern.replace(os.sep, "/")
+    if posix_pattern.startswith("/") or os.path.splitdrive(pattern)[0]:
+        raise ValueError(f"pattern must be relative: {pattern!r}")
+
+    segments: list[re.Pattern[str] | None] = [None]
+    for segment in posix_pattern.split("/"):
+        if segment in ("", "."):
+            continue
+        if segment == "**":
+            if segments[-1] is not None:
+                segments.append(None)
+            continue
+        segments.append(re.compile(fnmatch.translate(segment)))
+
+    dirs_only = posix_pattern.endswith("/") or segments[-1] is None
+    return tuple(segments), dirs_only
+
+
+def iter_all_entries(directory_path: Path) -> Iterator[tuple[str, os.DirEntry[str]]]:
+    """Yield posix relative paths and entries of everything below the directory.
+
+    This matches what the pattern '**/*' selects, as neither follows symlinks.
+    """
+    root_prefix_len = len(os.path.join(directory_path, ""))
+    for dir_entries, file_entries in walk_directory(directory_path):
+        for entry in itertools.chain(dir_entries, file_entries):
+            yield entry.path[root_prefix_len:].replace(os.sep, "/"), entry
+
+
+def iter_matching_entries(
+    directory_path: Path, patterns: Sequence[PathPattern]
+) -> Iterator[tuple[str, os.DirEntry[str]]]:
+    """Yield posix relative paths and entries matching any of the compiled patterns.
+
+    Like Path.rglob, '**' does not descend into symlinked directories while other
+    segments do, so that 'link/*' matches the entries of the linked directory.
+    Unreadable directories are skipped.
+    """
+    start = close_pattern_states(patterns, {(i, 0) for i in range(len(patterns))})
+    stack = [(os.fspath(directory_path), "", start)]
+    while stack:
+        current, prefix, states = stack.pop()
         try:
-            for path in directory_path.rglob(file_pattern):
-                if "venv" in str(path):
+            with os.scandir(current) as it:
+                entries = list(it)
+        except OSError as exc:
+            logger.debug("skipping: cannot scan %s -> %s", current, repr(exc))
+            continue
+
+        for entry in entries:
+            rel_path = f"{prefix}{entry.name}"
+            # each state is a pattern index and the position of its next segment
+            via_wildcard: set[tuple[int, int]] = set()
+            via_segment: set[tuple[int, int]] = set()
+            for ptrn_idx, seg_idx in states:
+                segments = patterns[ptrn_idx][0]
+                if seg_idx == len(segments):
                     continue
-                path.unlink()
-                logger.info("deleted: %s", path.relative_to(directory_path))
-                count += 1
-        except Exception as exc:
-            logger.warning("skipping: file pattern: %s -> %s", file_pattern, repr(exc))
+                segment = segments[seg_idx]
+                if segment is None:
+                    via_wildcard.add((ptrn_idx, seg_idx))
+                elif segment.match(entry.name) is not None:
+                    via_segment.add((ptrn_idx, seg_idx + 1))
+
+            is_symlink = entry.is_symlink()
+            if is_symlink:
+                # '**' never follows symlinks, only the other segments may match them
+                reached = close_pattern_states(patterns, via_segment)
+            else:
+                reached = close_pattern_states(patterns, via_wildcard | via_segment)
+
+            if any(
+                seg_idx == len(patterns[ptrn_idx][0])
+                and (not patterns[ptrn_idx][1] or entry.is_dir())
+                for ptrn_idx, seg_idx in reached
+            ):
+                yield rel_path, entry
+
+            if not entry.is_dir():
+                continue
+
+            # descend only where some pattern still has segments left to match
+            live = frozenset(
+                (ptrn_idx, seg_idx)
+                for ptrn_idx, seg_idx in reached
+                if seg_idx < len(patterns[ptrn_idx][0])
+            )
+            if live:
+                stack.append((entry.path, f"{rel_path}/", live))
+
+
+def close_pattern_states(
+    patterns: Sequence[PathPattern], states: set[tuple[int, int]]
+) -> frozenset[tuple[int, int]]:
+    """Return the states extended by letting each '**' match zero path segments."""
+    closed = set(states)
+    for ptrn_idx, seg_idx in states:
+        segments = patterns[ptrn_idx][0]
+        if seg_idx < len(segments) and segments[seg_idx] is None:
+            closed.add((ptrn_idx, seg_idx + 1))
+    return frozenset(closed)
+
+
+def walk_directory(
+    directory_path: Path,
+) -> Iterator[tuple[list[os.DirEntry[str]], list[os.DirEntry[str]]]]:
+    """Yield directory and non-directory entries of each directory, top-down.
+
+    Remove entries from the yielded directory list to prevent descending into them.
+    Symlinks are not followed and unreadable directories are skipped.
+    """
+    stack = [os.fspath(directory_path)]
+    while stack:
+        current = stack.pop()
+        dir_entries: list[os.DirEntry[str]] = []
+        file_entries: list[os.DirEntry[str]] = []
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        dir_entries.append(entry)
+                    else:
+                        file_entries.append(entry)
+        except OSError as exc:
+            logger.debug("skipping: cannot scan %s -> %s", current, repr(exc))
             continue
-    return count
+
+        yield dir_entries, file_entries
+        stack.extend(entry.path for entry in reversed(dir_entries))
 
 
 def delete_local_branches(protected_branches: set[str]) -> int:
     """Delete local git branches except protected ones."""
+    label = pk.meta.get_caller_name()
     local = get_local_branch_names()
     logger.debug("%d local branch(es) in total: %s", len(local), local)
 
@@ -178,19 +461,31 @@ def delete_local_branches(protected_branches: set[str]) -> int:
         return 0
 
     logger.debug("%d local branch(es) to delete: %s", len(to_delete), to_delete)
-    for branch in to_delete:
-        try:
-            run(f"git branch -D {branch}", pk.meta.get_caller_name())
+    try:
+        run(["git", "branch", "-D", *to_delete], label)
+    except subprocess.CalledProcessError:
+        # git deletes what it can, so retry the leftovers one by one to pinpoint errors
+        remaining = set(get_local_branch_names())
+        for branch in to_delete:
+            if branch not in remaining:
+                logger.info("deleted: %s", branch)
+                continue
+            try:
+                run(["git", "branch", "-D", branch], label)
+                logger.info("deleted: %s", branch)
+            except subprocess.CalledProcessError as exc:
+                logger.exception("error deleting local branch: %s", branch)
+                raise exc
+    else:
+        for branch in to_delete:
             logger.info("deleted: %s", branch)
-        except subprocess.CalledProcessError as exc:
-            logger.exception("error deleting local branch: %s", branch)
-            raise exc
 
     return len(to_delete)
 
 
 def delete_remote_branch_refs(protected_branches: set[str]) -> int:
     """Delete remote-tracking git branch refs except protected ones."""
+    label = pk.meta.get_caller_name()
     remote = get_remote_branch_names()
     to_delete = [r for r in remote if r.split("/", 1)[-1] not in protected_branches]
     if not to_delete:
@@ -198,13 +493,24 @@ def delete_remote_branch_refs(protected_branches: set[str]) -> int:
         return 0
 
     logger.debug("remote refs to delete: %d", len(to_delete))
-    for ref in to_delete:
-        try:
-            run(f"git branch -r -d {ref}", pk.meta.get_caller_name())
+    try:
+        run(["git", "branch", "-r", "-d", "--", *to_delete], label)
+    except subprocess.CalledProcessError:
+        # git deletes what it can, so retry the leftovers one by one to pinpoint errors
+        remaining = set(get_remote_branch_names())
+        for ref in to_delete:
+            if ref not in remaining:
+                logger.info("deleted: %s", ref)
+                continue
+            try:
+                run(["git", "branch", "-r", "-d", "--", ref], label)
+                logger.info("deleted: %s", ref)
+            except subprocess.CalledProcessError as exc:
+                logger.exception("error deleting remote ref: %s", ref)
+                raise exc
+    else:
+        for ref in to_delete:
             logger.info("deleted: %s", ref)
-        except subprocess.CalledProcessError as exc:
-            logger.exception("error deleting remote ref: %s", ref)
-            raise exc
 
     return len(to_delete)
 
@@ -212,7 +518,9 @@ def delete_remote_branch_refs(protected_branches: set[str]) -> int:
 def get_current_branch() -> str:
     """Return the current branch name."""
     try:
-        return run("git rev-parse --abbrev-ref HEAD", pk.meta.get_caller_name())
+        return run(
+            ["git", "rev-parse", "--abbrev-ref", "HEAD"], pk.meta.get_caller_name()
+        )
     except subprocess.CalledProcessError:
         logger.error("cannot determine current branch: repository has no commits yet")
         raise
@@ -220,33 +528,28 @@ def get_current_branch() -> str:
 
 def get_local_branch_names() -> list[str]:
     """Return list of local branch names."""
-    out = run("git branch", pk.meta.get_caller_name())
-    branches: list[str] = []
-    for line in out.splitlines():
-        branches.append(line.lstrip("*").strip())
-    return branches
+    command = ["git", "for-each-ref", "--format=%(refname:lstrip=2)", "refs/heads/"]
+    return run(command, pk.meta.get_caller_name()).splitlines()
 
 
 def get_remote_branch_names() -> list[str]:
     """Return list of remote-tracking branch refs."""
-    out = run("git branch --remotes", pk.meta.get_caller_name())
-    branches: list[str] = []
-    for line in out.splitlines():
-        line = line.strip()
-        if "->" in line:
-            continue
-        branches.append(line)
-    return branches
+    command = ["git", "for-each-ref", "--format=%(refname:lstrip=2)", "refs/remotes/"]
+    out = run(command, pk.meta.get_caller_name())
+    return [ref for ref in out.splitlines() if not ref.endswith("/HEAD")]
 
 
-def run(command: str | Sequence[str], label: str) -> str:
+def run(command: Sequence[str], label: str) -> str:
     """Return stdout as string of the executed command."""
-    cmd = shlex.split(command) if isinstance(command, str) else list(command)
-    response = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    response = subprocess.run(command, capture_output=True, text=True, check=True)
     result = response.stdout.strip()
-    logger.debug(
-        "run cmd: %s: %s -> %s", label, " ".join(cmd), result.replace("\n", ",")
-    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "run cmd: %s: %s -> %s",
+            label,
+            " ".join(command),
+            result.replace("\n", ","),
+        )
     return result
 
 
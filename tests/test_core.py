@@ -1,125 +1,372 @@
 import os
-import shutil
+import stat
+import subprocess
+import tarfile
+import zipfile
 from pathlib import Path
-from tempfile import TemporaryDirectory
+from typing import NamedTuple
 
 import pytest
+from pyfakefs.fake_filesystem import FakeFilesystem
 
 from fops import core
 
 
+@pytest.fixture(scope="class")
+def sample_src(fs_class: FakeFilesystem) -> Path:
+    """Return a source tree in a fake in-memory filesystem shared by a test class."""
+    src = Path("/src")
+    (src / "sub" / "deep").mkdir(parents=True)
+    (src / "file1.txt").write_text("hello")
+    (src / "sub" / "file2.txt").write_text("world")
+    (src / "sub" / "deep" / "low.md").write_text("low")
+    (src / "keep.md").write_text("keep")
+    (src / "skip.txt").write_text("skipme")
+    (src / "target.txt").write_text("target")
+    (src / "link").symlink_to("target.txt")
+    (src / "dlink").symlink_to("sub", target_is_directory=True)
+    return src
+
+
+def read_members(archive_path: Path) -> dict[str, bytes | None]:
+    """Return archive members with their data or link target, None for directories."""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            return {
+                i.filename.rstrip("/"): None if i.is_dir() else zf.read(i)
+                for i in zf.infolist()
+            }
+
+    members: dict[str, bytes | None] = {}
+    with tarfile.open(archive_path) as tf:
+        for m in tf.getmembers():
+            if m.isdir():
+                members[m.name] = None
+            elif m.issym():
+                members[m.name] = m.linkname.encode()
+            else:
+                members[m.name] = tf.extractfile(m).read()
+    return members
+
+
+def read_sources(src: Path, names: set[str]) -> dict[str, bytes | None]:
+    """Return source paths with their data or link target, None for directories."""
+    return {name: read_source(src / name) for name in names}
+
+
+def read_source(path: Path) -> bytes | None:
+    """Return data or link target of a source path, None for a directory."""
+    if path.is_symlink():
+        return os.readlink(path).encode()
+    if path.is_dir():
+        return None
+    return path.read_bytes()
+
+
+def read_symlink_names(archive_path: Path) -> set[str]:
+    """Return names of archive members stored as symbolic links."""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            return {
+                i.filename for i in zf.infolist() if stat.S_ISLNK(i.external_attr >> 16)
+            }
+
+    with tarfile.open(archive_path) as tf:
+        return {m.name for m in tf.getmembers() if m.issym()}
+
+
+ALL_MEMBERS = {
+    "dlink",
+    "file1.txt",
+    "keep.md",
+    "link",
+    "skip.txt",
+    "sub",
+    "sub/deep",
+    "sub/deep/low.md",
+    "sub/file2.txt",
+    "target.txt",
+}
+
+
+class ArchiveCase(NamedTuple):
+    archive_name: str | None
+    archive_format: str
+    patterns: list[str] | None
+    expected_name: str
+    expected_members: set[str]
+
+
+class CreatedArchive(NamedTuple):
+    result: Path
+    path: Path
+    expected_name: str
+    expected_members: set[str]
+
+
+ARCHIVE_CASES = {
+    "default": ArchiveCase(
+        archive_name=None,
+        archive_format="zip",
+        patterns=None,
+        expected_name="20250101010101-src.zip",
+        expected_members=ALL_MEMBERS,
+    ),
+    "name": ArchiveCase(
+        archive_name="myarchive",
+        archive_format="zip",
+        patterns=None,
+        expected_name="myarchive.zip",
+        expected_members=ALL_MEMBERS,
+    ),
+    "overlap": ArchiveCase(
+        archive_name="overlap",
+        archive_format="zip",
+        patterns=["**/*", "*.md"],
+        expected_name="overlap.zip",
+        expected_members=ALL_MEMBERS,
+    ),
+    "pattern": ArchiveCase(
+        archive_name="pat",
+        archive_format="zip",
+        patterns=["*.md"],
+        expected_name="pat.zip",
+        expected_members={"keep.md", "sub/deep/low.md"},
+    ),
+    "nested": ArchiveCase(
+        archive_name="nested",
+        archive_format="zip",
+        patterns=["sub/*.txt", "deep/*.md"],
+        expected_name="nested.zip",
+        expected_members={"sub/deep/low.md", "sub/file2.txt"},
+    ),
+    "os-sep": ArchiveCase(
+        archive_name="sep",
+        archive_format="zip",
+        patterns=[os.path.join("sub", "*.txt")],
+        expected_name="sep.zip",
+        expected_members={"sub/file2.txt"},
+    ),
+    "dirs-only": ArchiveCase(
+        archive_name="dirs",
+        archive_format="zip",
+        patterns=["*/"],
+        expected_name="dirs.zip",
+        expected_members={"dlink", "sub", "sub/deep"},
+    ),
+    "subtree": ArchiveCase(
+        archive_name="subtree",
+        archive_format="zip",
+        patterns=["sub/**"],
+        expected_name="subtree.zip",
+        expected_members={"sub", "sub/deep"},
+    ),
+    "linked-dir": ArchiveCase(
+        archive_name="linked",
+        archive_format="gztar",
+        patterns=["dlink/*"],
+        expected_name="linked.tar.gz",
+        expected_members={"dlink/deep", "dlink/file2.txt"},
+    ),
+    "gztar": ArchiveCase(
+        archive_name="sym",
+        archive_format="gztar",
+        patterns=None,
+        expected_name="sym.tar.gz",
+        expected_members=ALL_MEMBERS,
+    ),
+}
+
+
+@pytest.fixture(scope="class", params=list(ARCHIVE_CASES))
+def archive(sample_src: Path, request: pytest.FixtureRequest) -> CreatedArchive:
+    """Create one archive per case, shared by the assertion tests of a class."""
+    case = ARCHIVE_CASES[request.param]
+    work_dir = Path("/work", request.param)
+    work_dir.mkdir(parents=True)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(core, "get_timestamp", lambda: "20250101010101")
+        mp.chdir(work_dir)
+        result = core.create_archive(
+            sample_src, case.patterns, case.archive_name, case.archive_format
+        )
+    return CreatedArchive(
+        result, work_dir / result, case.expected_name, case.expected_members
+    )
+
+
 class TestCreateArchive:
-    def _patch_timestamp(self, value: str):
-        """Patch get_timestamp, return a restore callable."""
-        orig = core.get_timestamp
-        core.get_timestamp = lambda: value
-        return lambda: setattr(core, "get_timestamp", orig)
-
-    def _chdir(self, new_cwd: str | Path):
-        """Change cwd, return a restore callable."""
-        old = os.getcwd()
-        os.chdir(new_cwd)
-        return lambda: os.chdir(old)
-
-    def test_create_archive_default_name_and_contents(self):
-        with TemporaryDirectory() as srcdir, TemporaryDirectory() as workdir:
-            src = Path(srcdir)
-            (src / "file1.txt").write_text("hello")
-            (src / "sub").mkdir()
-            (src / "sub" / "file2.txt").write_text("world")
-
-            restore_ts = self._patch_timestamp("20250101010101")
-            restore_cwd = self._chdir(workdir)
-            try:
-                core.create_archive(src)  # uses patched timestamp
-                expected = Path(workdir) / f"20250101010101-{Path(srcdir).stem}.zip"
-                assert expected.exists(), "archive file was not created"
-
-                extract_dir = Path(workdir) / "ex"
-                shutil.unpack_archive(str(expected), str(extract_dir))
-                assert (extract_dir / "file1.txt").read_text() == "hello"
-                assert (extract_dir / "sub" / "file2.txt").read_text() == "world"
-            finally:
-                restore_cwd()
-                restore_ts()
-
-    def test_create_archive_with_archive_name(self):
-        with TemporaryDirectory() as srcdir, TemporaryDirectory() as workdir:
-            src = Path(srcdir)
-            (src / "a.txt").write_text("x")
-
-            restore_ts = self._patch_timestamp("20250101010101")
-            restore_cwd = self._chdir(workdir)
-            try:
-                core.create_archive(src, archive_name="myarchive")
-                expected = Path(workdir) / "myarchive.zip"
-                assert expected.exists()
-                extract_dir = Path(workdir) / "ex2"
-                shutil.unpack_archive(str(expected), str(extract_dir))
-                assert (extract_dir / "a.txt").read_text() == "x"
-            finally:
-                restore_cwd()
-                restore_ts()
-
-    def test_create_archive_pattern_filtering(self):
-        with TemporaryDirectory() as srcdir, TemporaryDirectory() as workdir:
-            src = Path(srcdir)
-            (src / "keep.md").write_text("keep")
-            (src / "skip.txt").write_text("skipme")
-
-            restore_ts = self._patch_timestamp("20250101010101")
-            restore_cwd = self._chdir(workdir)
-            try:
-                core.create_archive(src, archive_name="pat", patterns=["*.md"])
-                expected = Path(workdir) / "pat.zip"
-                assert expected.exists()
-                extract_dir = Path(workdir) / "ex3"
-                shutil.unpack_archive(str(expected), str(extract_dir))
-                assert (extract_dir / "keep.md").exists()
-                assert not (extract_dir / "skip.txt").exists()
-            finally:
-                restore_cwd()
-                restore_ts()
-
-    def test_create_archive_preserves_symlink_in_tar(self):
-        # Use a tar-based format that preserves symlinks reliably.
-        with TemporaryDirectory() as srcdir, TemporaryDirectory() as workdir:
-            src = Path(srcdir)
-            (src / "target.txt").write_text("target")
-            (src / "link").symlink_to(src / "target.txt")
-
-            restore_ts = self._patch_timestamp("20250101010101")
-            restore_cwd = self._chdir(workdir)
-            try:
-                # gztar should preserve symlink entries
-                core.create_archive(src, archive_name="sym", archive_format="gztar")
-                expected = Path(workdir) / "sym.tar.gz"
-                assert expected.exists()
-                extract_dir = Path(workdir) / "ex4"
-                shutil.unpack_archive(str(expected), str(extract_dir))
-                extracted_link = extract_dir / "link"
-                # On platforms that preserve symlinks, this will be True.
-                # We assert at least that the link target's content exists and matches.
-                if extracted_link.is_symlink():
-                    # symlink preserved
-                    assert extracted_link.resolve().read_text() == "target"
-                else:
-                    # zip-like behavior: the file content was archived instead
-                    assert extracted_link.read_text() == "target"
-            finally:
-                restore_cwd()
-                restore_ts()
-
-    def test_invalid_archive_format_raises(self):
-        with TemporaryDirectory() as srcdir, TemporaryDirectory() as workdir:
-            src = Path(srcdir)
-            (src / "a.txt").write_text("x")
-
-            restore_ts = self._patch_timestamp("20250101010101")
-            restore_cwd = self._chdir(workdir)
-            try:
-                with pytest.raises(ValueError):
-                    core.create_archive(src, archive_format="INVALID_FORMAT")
-            finally:
-                restore_cwd()
-                restore_ts()
+    def test_create_archive_returns_name(self, archive: CreatedArchive):
+        assert archive.result == Path(archive.expected_name)
+
+    def test_create_archive_writes_file(self, archive: CreatedArchive):
+        assert archive.path.is_file(), "archive file was not created"
+
+    def test_create_archive_members(self, sample_src: Path, archive: CreatedArchive):
+        members = read_members(archive.path)
+        assert members == read_sources(sample_src, archive.expected_members)
+
+    def test_create_archive_preserves_symlinks(
+        self, sample_src: Path, archive: CreatedArchive
+    ):
+        names = archive.expected_members
+        expected = {n for n in names if (sample_src / n).is_symlink()}
+        assert read_symlink_names(archive.path) == expected
+
+    def test_create_archive_relative_path_follows_cwd(
+        self, fs_class: FakeFilesystem, monkeypatch: pytest.MonkeyPatch
+    ):
+        # equal mtimes, as left by tar, rsync or cp -p, must not mix up the trees
+        for name in ("p1", "p2"):
+            src = Path("/rel", name, "A")
+            src.mkdir(parents=True)
+            (src / f"{name}.txt").write_text(name)
+            os.utime(src, ns=(0, 0))
+
+        for name in ("p1", "p2"):
+            monkeypatch.chdir(Path("/rel", name))
+            archive_path = core.create_archive(Path("A"), archive_name="arc")
+            assert read_members(archive_path) == {f"{name}.txt": name.encode()}
+
+    @pytest.mark.parametrize("archive_format", ["zip", "gztar"])
+    def test_create_archive_removes_partial_archive_on_error(
+        self, sample_src: Path, monkeypatch: pytest.MonkeyPatch, archive_format: str
+    ):
+        work_dir = Path("/work", f"failed-{archive_format}")
+        work_dir.mkdir(parents=True)
+        monkeypatch.chdir(work_dir)
+
+        def add_fails(
+            archive: zipfile.ZipFile | tarfile.TarFile,
+            entry: os.DirEntry[str],
+            arcname: str,
+        ) -> None:
+            raise PermissionError(entry.path)
+
+        monkeypatch.setattr(core, "add_to_archive", add_fails)
+        with pytest.raises(PermissionError):
+            core.create_archive(
+                sample_src, archive_name="arc", archive_format=archive_format
+            )
+        assert list(work_dir.iterdir()) == []
+
+    @pytest.mark.parametrize("archive_format", ["zip", "gztar"])
+    def test_create_archive_skips_previous_archive_in_cwd(
+        self, sample_src: Path, monkeypatch: pytest.MonkeyPatch, archive_format: str
+    ):
+        work_dir = Path("/work", f"self-{archive_format}")
+        work_dir.mkdir(parents=True)
+        (work_dir / "a.txt").write_text("a")
+        monkeypatch.chdir(work_dir)
+
+        for _ in range(2):
+            archive_path = core.create_archive(
+                Path("."), archive_name="self", archive_format=archive_format
+            )
+            assert read_members(archive_path) == {"a.txt": b"a"}
+        assert sorted(p.name for p in work_dir.iterdir()) == [
+            "a.txt",
+            archive_path.name,
+        ]
+
+    @pytest.mark.parametrize("pattern", ["", "/x", f"{os.sep}sub"])
+    def test_unsupported_pattern_raises(self, sample_src: Path, pattern: str):
+        with pytest.raises(ValueError):
+            core.create_archive(sample_src, [pattern])
+
+    def test_invalid_archive_format_raises(self, sample_src: Path):
+        with pytest.raises(ValueError):
+            core.create_archive(sample_src, archive_format="INVALID_FORMAT")
+
+
+class TestDeleteCache:
+    def test_delete_cache_dirs_and_files(self, tmp_path: Path):
+        (tmp_path / "__pycache__").mkdir()
+        (tmp_path / "__pycache__" / "mod.cpython-311.pyc").write_bytes(b"")
+        (tmp_path / "pkg" / "__pycache__").mkdir(parents=True)
+        (tmp_path / "pkg" / "mod.pyc").write_bytes(b"")
+        (tmp_path / "pkg" / "mod.py").write_text("x = 1")
+        (tmp_path / ".coverage").write_text("")
+
+        count = core.delete_cache(tmp_path, {"__pycache__"}, {"*.py[co]", ".coverage"})
+
+        assert count == 4
+        assert sorted(p.name for p in tmp_path.rglob("*")) == ["mod.py", "pkg"]
+
+    def test_delete_cache_dir_with_subdirs(self, tmp_path: Path):
+        (tmp_path / ".pytest_cache" / "v" / "cache").mkdir(parents=True)
+        (tmp_path / ".pytest_cache" / "v" / "cache" / "nodeids").write_text("[]")
+        (tmp_path / ".pytest_cache" / "README.md").write_text("cache")
+
+        assert core.delete_cache_dirs(tmp_path, {".pytest_cache"}) == 1
+        assert not (tmp_path / ".pytest_cache").exists()
+
+    @pytest.mark.parametrize("pruned", [".git", ".venv", "node_modules", "venv"])
+    def test_delete_cache_skips_pruned_dirs(self, tmp_path: Path, pruned: str):
+        cache_dir = tmp_path / pruned / "lib" / "__pycache__"
+        cache_dir.mkdir(parents=True)
+        (tmp_path / pruned / "mod.pyc").write_bytes(b"")
+
+        assert core.delete_cache_dirs(tmp_path, {"__pycache__"}) == 0
+        assert core.delete_cache_files(tmp_path, {"*.pyc"}) == 0
+        assert cache_dir.is_dir()
+        assert (tmp_path / pruned / "mod.pyc").is_file()
+
+    def test_delete_cache_deletes_pruned_dir_matching_pattern(self, tmp_path: Path):
+        (tmp_path / "node_modules" / "pkg").mkdir(parents=True)
+        (tmp_path / "node_modules" / "pkg" / "index.js").write_text("")
+
+        assert core.delete_cache_dirs(tmp_path, {"node_modules"}) == 1
+        assert not (tmp_path / "node_modules").exists()
+
+    def test_delete_cache_custom_prune_dirs(self, tmp_path: Path):
+        (tmp_path / "venv" / "__pycache__").mkdir(parents=True)
+        (tmp_path / "build" / "__pycache__").mkdir(parents=True)
+
+        count = core.delete_cache(tmp_path, {"__pycache__"}, set(), {"build"})
+
+        assert count == 1
+        assert not (tmp_path / "venv" / "__pycache__").exists()
+        assert (tmp_path / "build" / "__pycache__").is_dir()
+
+
+class TestDeleteBranches:
+    @pytest.fixture
+    def repo(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+        for var in ("AUTHOR", "COMMITTER"):
+            monkeypatch.setenv(f"GIT_{var}_NAME", "fops")
+            monkeypatch.setenv(f"GIT_{var}_EMAIL", "fops@example.com")
+        monkeypatch.chdir(tmp_path)
+
+        def git(*args: str) -> None:
+            subprocess.run(["git", *args], check=True, capture_output=True)
+
+        git("init", "-b", "main")
+        git("commit", "--allow-empty", "-m", "init")
+        for name in ("feat-a", "feat-b", "keep"):
+            git("branch", name)
+            git("update-ref", f"refs/remotes/origin/{name}", "HEAD")
+        git("symbolic-ref", "refs/remotes/origin/HEAD", "refs/remotes/origin/keep")
+        return tmp_path
+
+    def test_get_branch_names(self, repo: Path):
+        assert core.get_local_branch_names() == ["feat-a", "feat-b", "keep", "main"]
+        assert core.get_remote_branch_names() == [
+            "origin/feat-a",
+            "origin/feat-b",
+            "origin/keep",
+        ]
+
+    def test_delete_local_branches(self, repo: Path):
+        assert core.delete_local_branches({"main", "keep"}) == 2
+        assert core.get_local_branch_names() == ["keep", "main"]
+
+    def test_delete_local_branches_reports_failing_branch(self, repo: Path):
+        # the checked out branch cannot be deleted, the others still are
+        with pytest.raises(subprocess.CalledProcessError):
+            core.delete_local_branches({"keep"})
+        assert core.get_local_branch_names() == ["keep", "main"]
+
+    def test_delete_remote_branch_refs(self, repo: Path):
+        assert core.delete_remote_branch_refs({"keep"}) == 2
+        assert core.get_remote_branch_names() == ["origin/keep"]